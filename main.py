@@ -1,48 +1,79 @@
 # main.py - 完整可用的天气应用
 from fastapi import FastAPI, Request, Form, Depends
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+from sqlalchemy import event, func, inspect, select, create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
-from datetime import datetime
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import StaticPool
+from itertools import islice
+import asyncio
 import csv
-import aiohttp
+import httpx
+import orjson
+from cachetools import TTLCache
 import os
 
-# ========== 模型定义 ==========
-Base = declarative_base()
-
-class City(Base):
-    __tablename__ = "cities"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    latitude = Column(Float, nullable=False)
-    longitude = Column(Float, nullable=False)
-    temperature = Column(Float, nullable=True)
-    updated_at = Column(DateTime, default=datetime.utcnow)
-
-class DefaultCity(Base):
-    __tablename__ = "default_cities"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, nullable=False)
-    latitude = Column(Float, nullable=False)
-    longitude = Column(Float, nullable=False)
-# ========== 模型定义结束 ==========
+from models import Base, City, DefaultCity
 
 # 数据库设置
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./cities.db")
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 每个请求的 session 直接从连接池里取已建立的连接
+_url = make_url(DATABASE_URL)
+if _url.get_backend_name() == "sqlite":
+    # 文件库默认即为 QueuePool；内存库每个连接都是独立的空库，只能共用一个连接
+    engine_options = {"connect_args": {"check_same_thread": False}}
+    if _url.database in (None, "", ":memory:"):
+        engine_options["poolclass"] = StaticPool
+else:
+    engine_options = {"pool_size": 10, "max_overflow": 20}
+engine = create_engine(DATABASE_URL, **engine_options)
 
-# 创建表
-Base.metadata.create_all(bind=engine)
+if engine.dialect.name == "sqlite":
+    # WAL 模式下提交只追加日志，读写互不阻塞
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        # cache_size 按连接生效，连接池最多 15 个连接，每个限制在 8 MB
+        cur.execute("PRAGMA cache_size=-8000")
+        cur.close()
+
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+# 导入 CSV 时每批插入的行数
+CSV_BATCH_SIZE = 10000
+
+# 创建表：一次查询取出已有表名，表都存在时跳过 create_all 的逐表探测
+_inspector = inspect(engine)
+if not set(Base.metadata.tables) <= set(_inspector.get_table_names()):
+    Base.metadata.create_all(bind=engine)
+# create_all 不会给已存在的表补建索引：一次查询取出已有索引，只补建缺失的
+_existing_indexes = {index["name"] for index in _inspector.get_indexes(City.__tablename__)}
+for index in City.__table__.indexes:
+    if index.name not in _existing_indexes:
+        index.create(bind=engine)
 
 # ========== 关键！必须创建 app 实例 ==========
 app = FastAPI()
 # ========== 关键结束 ==========
 
-templates = Jinja2Templates(directory="templates")
+# 模板编译结果缓存到磁盘，新启动的 worker 无需重新解析模板。
+# 未指定 TEMPLATE_CACHE_DIR 时使用 Jinja 默认的按用户隔离、权限 0700 的缓存目录
+TEMPLATE_CACHE_DIR = os.environ.get("TEMPLATE_CACHE_DIR")
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+# 开发时模板修改即时生效；生产环境设置 TEMPLATE_AUTO_RELOAD=0 省去每次渲染前的文件检查
+TEMPLATE_AUTO_RELOAD = os.environ.get("TEMPLATE_AUTO_RELOAD", "1") != "0"
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader("templates"),
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    autoescape=True,
+))
 
 # 工具函数
 def get_db():
@@ -52,23 +83,78 @@ def get_db():
     finally:
         db.close()
 
-async def fetch_weather(latitude: float, longitude: float):
+def parse_temperature(raw: bytes):
+    # 只需要 current_weather.temperature 一个字段，直接在字节串里定位，
+    # 省去整段 JSON 解析；注意 current_weather_units 里也有 "temperature" 键
+    i = raw.find(b'"current_weather":')
+    if i != -1:
+        # current_weather 是不嵌套的对象，只在它的范围内查找
+        i = raw.find(b'"temperature":', i, raw.find(b"}", i))
+    if i != -1:
+        i += len(b'"temperature":')
+        j = raw.find(b",", i)
+        k = raw.find(b"}", i)
+        if j == -1 or (k != -1 and k < j):
+            j = k
+        try:
+            return float(raw[i:j])
+        except ValueError:
+            pass
+    # 格式不符合预期时退回完整解析
+    data = orjson.loads(raw)
+    return data.get("current_weather", {}).get("temperature")
+
+async def fetch_weather(client: httpx.AsyncClient, latitude: float, longitude: float):
     try:
-        async with aiohttp.ClientSession() as session:
-            url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current_weather=true"
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data.get("current_weather", {}).get("temperature")
+        url = f"https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current_weather=true"
+        response = await client.get(url)
+        if response.status_code == 200:
+            return parse_temperature(response.content)
     except Exception as e:
         print(f"获取天气失败: {e}")
         return None
 
+# 按坐标缓存温度，短时间内重复刷新不再请求 Open-Meteo
+_weather_cache = TTLCache(maxsize=1024, ttl=600)
+# 正在进行中的请求，同一坐标的并发调用共享一个结果
+_weather_inflight = {}
+
+async def fetch_weather_cached(client: httpx.AsyncClient, latitude: float, longitude: float):
+    key = (round(latitude, 3), round(longitude, 3))
+    if key in _weather_cache:
+        return _weather_cache[key]
+    task = _weather_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch_weather(client, latitude, longitude))
+        _weather_inflight[key] = task
+        task.add_done_callback(lambda t: _store_weather(key, t))
+    # shield：某个调用方被取消时，不会连带取消其他调用方共享的请求
+    return await asyncio.shield(task)
+
+def _store_weather(key, task: asyncio.Task):
+    _weather_inflight.pop(key, None)
+    if not task.cancelled() and task.exception() is None and task.result() is not None:
+        _weather_cache[key] = task.result()
+
 # 路由
 @app.get("/")
 async def read_root(request: Request, db: SessionLocal = Depends(get_db)):
-    cities = db.query(City).all()
-    return templates.TemplateResponse("index.html", {"request": request, "cities": cities})
+    # 先用一条聚合查询判断数据是否有变化，未变化时不查明细、不渲染模板，直接返回 304。
+    # 新增和刷新会改变 max(updated_at)，删除会改变 count
+    count, max_id, last = db.query(func.count(City.id), func.max(City.id), func.max(City.updated_at)).one()
+    etag = f'W/"{count}-{max_id or 0}-{last.isoformat() if last else ""}"'
+    validators = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=validators)
+
+    # 只取模板用到的列，返回轻量的 Row 而不是 ORM 对象
+    cities = db.execute(
+        select(City.id, City.name, City.latitude, City.longitude, City.temperature)
+    ).all()
+    # 边渲染边发送，不在内存中拼出整页 HTML
+    stream = templates.env.get_template("index.html").stream({"request": request, "cities": cities})
+    stream.enable_buffering()
+    return StreamingResponse(stream, media_type="text/html", headers=validators)
 
 @app.post("/cities/add")
 async def add_city(name: str = Form(...), latitude: float = Form(...), longitude: float = Form(...), db: SessionLocal = Depends(get_db)):
@@ -79,10 +165,8 @@ async def add_city(name: str = Form(...), latitude: float = Form(...), longitude
 
 @app.post("/cities/remove/{city_id}")
 async def remove_city(city_id: int, db: SessionLocal = Depends(get_db)):
-    city = db.query(City).filter(City.id == city_id).first()
-    if city:
-        db.delete(city)
-        db.commit()
+    db.query(City).filter(City.id == city_id).delete(synchronize_session=False)
+    db.commit()
     return RedirectResponse("/", status_code=303)
 
 @app.post("/cities/reset")
@@ -95,22 +179,40 @@ async def reset_cities(db: SessionLocal = Depends(get_db)):
         ("Rome", 41.9028, 12.4964),
         ("Madrid", 40.4168, -3.7038)
     ]
-    for name, lat, lon in default_cities:
-        db.add(City(name=name, latitude=lat, longitude=lon))
+    rows = [{"name": name, "latitude": lat, "longitude": lon} for name, lat, lon in default_cities]
+    db.execute(City.__table__.insert(), rows)
     db.commit()
     return RedirectResponse("/", status_code=303)
 
 @app.post("/cities/update")
-async def update_weather(db: SessionLocal = Depends(get_db)):
-    cities = db.query(City).all()
-    for city in cities:
-        temp = await fetch_weather(city.latitude, city.longitude)
-        if temp is not None:
-            city.temperature = temp
-            city.updated_at = datetime.utcnow()
+async def update_weather(request: Request, db: SessionLocal = Depends(get_db)):
+    cities = db.execute(select(City.id, City.latitude, City.longitude)).all()
+    client = request.app.state.http
+    # 并发请求所有城市，总耗时约等于最慢的一次请求
+    coros = [fetch_weather_cached(client, city.latitude, city.longitude) for city in cities]
+    temps = await asyncio.gather(*coros, return_exceptions=True)
+    # 一次 executemany 批量更新，不再逐个对象 flush；updated_at 由 onupdate 生成
+    updates = [
+        {"id": city.id, "temperature": temp}
+        for city, temp in zip(cities, temps)
+        if isinstance(temp, (int, float))
+    ]
+    db.bulk_update_mappings(City, updates)
     db.commit()
     return RedirectResponse("/", status_code=303)
 
+@app.on_event("startup")
+async def open_http_client():
+    # 所有天气请求共用一个 HTTP/2 客户端，并发请求在同一连接上多路复用
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    )
+
+@app.on_event("shutdown")
+async def close_http_client():
+    await app.state.http.aclose()
+
 @app.on_event("startup")
 def populate_default_cities():
     db = SessionLocal()
@@ -119,13 +221,32 @@ def populate_default_cities():
             print("初始化默认城市数据...")
             try:
                 with open("europe.csv", "r", encoding="utf-8") as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        db.add(DefaultCity(
-                            name=row["name"],
-                            latitude=float(row["latitude"]),
-                            longitude=float(row["longitude"])
-                        ))
+                    reader = csv.reader(f)
+                    # 表头只解析一次，之后按列下标取值，避免每行构造 dict；
+                    # 和 DictReader 一样跳过空行（csv.reader 对空行返回 []）
+                    header = next((row for row in reader if row), [])
+                    if header:
+                        ni = header.index("name")
+                        lai = header.index("latitude")
+                        loi = header.index("longitude")
+                    # 分批读取并执行插入，内存占用以单批为上限；
+                    # 走 Core 的 executemany，绕过 ORM 的逐对象状态跟踪
+                    while True:
+                        chunk = list(islice(reader, CSV_BATCH_SIZE))
+                        if not chunk:
+                            break
+                        rows = [
+                            {
+                                "name": row[ni],
+                                "latitude": float(row[lai]),
+                                "longitude": float(row[loi]),
+                            }
+                            for row in chunk
+                            if row
+                        ]
+                        if rows:
+                            db.execute(DefaultCity.__table__.insert(), rows)
+                # 所有批次在同一个事务里，中途失败会整体回滚，下次启动重新导入
                 db.commit()
                 print("默认城市数据初始化完成")
             except FileNotFoundError:
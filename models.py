@@ -0,0 +1,52 @@
+# models.py - 数据库模型定义
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.sql.expression import FunctionElement
+
+Base = declarative_base()
+
+# 数据库端生成的 UTC 时间戳（不带时区，按 UTC 解读）。
+# SQLite 的 CURRENT_TIMESTAMP 只精确到秒，同一秒内的多次写入无法区分，改用带毫秒的 strftime；
+# PostgreSQL / SQL Server 的 CURRENT_TIMESTAMP 是会话本地时间，需显式转成 UTC。
+# 其他数据库没有对应的编译规则，会直接报错而不是悄悄写入本地时间
+class UtcNow(FunctionElement):
+    type = DateTime()
+    inherit_cache = True
+
+@compiles(UtcNow, "sqlite")
+def _sqlite_utcnow(element, compiler, **kw):
+    return "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+@compiles(UtcNow, "postgresql")
+def _postgresql_utcnow(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+@compiles(UtcNow, "mssql")
+def _mssql_utcnow(element, compiler, **kw):
+    return "SYSUTCDATETIME()"
+
+class City(Base):
+    __tablename__ = "cities"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    temperature = Column(Float, nullable=True)
+    # 时间戳由数据库生成
+    updated_at = Column(
+        DateTime,
+        index=True,
+        default=UtcNow(),
+        server_default=UtcNow(),
+        onupdate=UtcNow(),
+    )
+
+    __table_args__ = (Index("ix_city_lat_lon", "latitude", "longitude"),)
+
+class DefaultCity(Base):
+    __tablename__ = "default_cities"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
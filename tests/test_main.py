@@ -0,0 +1,108 @@
+import asyncio
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # 模板目录和 europe.csv 都按相对路径读取
+    monkeypatch.chdir(ROOT)
+    with TestClient(main.app) as client:
+        client.post("/cities/reset")
+        yield client
+
+
+def test_etag_unchanged_returns_304(client):
+    etag = client.get("/").headers["etag"]
+    assert client.get("/", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_same_second_update_changes_etag(client, monkeypatch):
+    async def fake_fetch(client, latitude, longitude):
+        return 21.5
+
+    monkeypatch.setattr(main, "fetch_weather_cached", fake_fetch)
+    etag = client.get("/").headers["etag"]
+    client.post("/cities/update")
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert "21.5°C" in response.text
+
+
+def test_remove_city_changes_etag(client):
+    etag = client.get("/").headers["etag"]
+    with main.SessionLocal() as db:
+        city_id = db.query(main.City.id).first().id
+    client.post(f"/cities/remove/{city_id}")
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    # 只带 If-Modified-Since 的请求不会拿到过期的 304
+    response = client.get("/", headers={"If-Modified-Since": "Fri, 31 Dec 2100 00:00:00 GMT"})
+    assert response.status_code == 200
+
+
+def test_populate_default_cities_skips_blank_lines(tmp_path, monkeypatch):
+    (tmp_path / "europe.csv").write_text(
+        "\ncountry,name,latitude,longitude\n"
+        "Austria,Vienna,48.2082,16.3738\n"
+        "\n"
+        "France,Paris,48.8566,2.3522\n\n",
+        encoding="utf-8",
+    )
+    monkeypatch.chdir(tmp_path)
+    with main.SessionLocal() as db:
+        db.query(main.DefaultCity).delete()
+        db.commit()
+    main.populate_default_cities()
+    with main.SessionLocal() as db:
+        names = [city.name for city in db.query(main.DefaultCity).order_by(main.DefaultCity.id)]
+    assert names == ["Vienna", "Paris"]
+
+
+def test_cancelled_caller_does_not_cancel_shared_fetch(monkeypatch):
+    async def slow_fetch(client, latitude, longitude):
+        await asyncio.sleep(0.05)
+        return 12.5
+
+    monkeypatch.setattr(main, "fetch_weather", slow_fetch)
+    main._weather_cache.clear()
+
+    async def run():
+        first = asyncio.ensure_future(main.fetch_weather_cached(None, 10.0, 20.0))
+        second = asyncio.ensure_future(main.fetch_weather_cached(None, 10.0, 20.0))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == 12.5
+    assert main._weather_cache[(10.0, 20.0)] == 12.5
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        # current_weather_units 里的 "temperature" 是单位字符串，不能误取
+        (
+            b'{"current_weather_units":{"time":"iso8601","temperature":"\xc2\xb0C"},'
+            b'"current_weather":{"time":"2026-10-15T12:00","temperature":12.5,"windspeed":3.0}}',
+            12.5,
+        ),
+        # 值后面紧跟 } 而不是 ,
+        (b'{"current_weather":{"windspeed":3.0,"temperature":-3}}', -3.0),
+        # null 走完整解析
+        (b'{"current_weather":{"temperature":null}}', None),
+        # current_weather 里没有 temperature，不能取到后面其他对象的同名键
+        (b'{"current_weather":{"windspeed":3.0},"other":{"temperature":99.0}}', None),
+        (b'{"latitude":52.52}', None),
+    ],
+)
+def test_parse_temperature(raw, expected):
+    assert main.parse_temperature(raw) == expected